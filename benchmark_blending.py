@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+(c) L3i - Univ. La Rochelle
+    joseph.chazalon (at) univ-lr (dot) fr
+
+SmartDoc 2017 Sample Method
+
+This is a simple benchmark program which compares the time taken to blend
+synthetic frames, and the memory used to do it, with the former copy-over
+approach and with the `Blender` class.
+Memory is measured as the growth of the peak resident set size of a child
+process, which requires Linux.
+"""
+
+# ==============================================================================
+# Imports
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from processing.Blender import Blender
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SD17-blending-bench"
+PROG_DESCRIPTION = "SmartDoc 2017 Sample Method - blending benchmark"
+EXITCODE_OK = 0
+EXITCODE_KBDBREAK = 10
+
+# ==============================================================================
+def random_transforms(num_frames, frame_w, frame_h, target_w, target_h, seed=0):
+    '''
+    Returns `num_frames` random frame to target transforms, the document
+    covering most of the frame.
+    '''
+    rng = np.random.RandomState(seed)
+    target_poly = np.float32([[0, 0], [0, target_h-1],
+                              [target_w-1, target_h-1], [target_w-1, 0]])
+    base_poly = np.float32([[0.2, 0.1], [0.2, 0.9], [0.8, 0.9], [0.8, 0.1]])
+    base_poly *= (frame_w, frame_h)
+    transforms = []
+    for _ in range(num_frames):
+        jitter = rng.uniform(-0.08, 0.08, (4, 2)) * (frame_w, frame_h)
+        object_poly = np.float32(base_poly + jitter)
+        transforms.append(cv2.getPerspectiveTransform(object_poly, target_poly))
+    return transforms
+
+def blend_copy_over(frames, transforms, frame_w, frame_h, target_w, target_h):
+    '''
+    Former blending code of `VideoCapture.process_video()`: the first frame
+    plays the reference frame, warped into the 8 bits result image, and the
+    next ones are copied over it.
+    '''
+    result_image = cv2.warpPerspective(frames[0], transforms[0], (target_w, target_h))
+    frame_poly = np.float32([[0, 0], [0, frame_h-1],
+                             [frame_w-1, frame_h-1], [frame_w-1, 0]])
+    for (frame, trans) in zip(frames[1:], transforms[1:]):
+        mask = np.zeros(result_image.shape, dtype=np.uint8)
+        result_roi = cv2.perspectiveTransform(
+            frame_poly.reshape(1, -1, 2), trans).reshape(-1, 2)
+        cv2.fillPoly(mask, [np.int32(result_roi)], (255, 255, 255))
+        pre_result = cv2.warpPerspective(frame, trans, (target_w, target_h))
+        np.copyto(result_image, pre_result, where=(mask>0))
+    return result_image
+
+def blend_accumulate(frames, transforms, target_w, target_h):
+    blender = Blender((target_h, target_w))
+    for (frame, trans) in zip(frames, transforms):
+        blender.add_frame(frame, trans)
+    return blender.get_result()
+
+def measure(func, *args):
+    '''
+    Runs `func(*args)` in a child process and returns a tuple with the time
+    it took, in seconds, and the growth of the peak resident set size of the
+    process, in MB.
+    '''
+    queue = multiprocessing.Queue()
+    def run():
+        with open("/proc/self/statm") as infile:
+            start_rss = int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        # ru_maxrss is in KB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        queue.put((elapsed, (peak_rss - start_rss) / float(2**20)))
+    child = multiprocessing.Process(target=run)
+    child.start()
+    result = queue.get()
+    child.join()
+    return result
+
+# ==============================================================================
+# ==============================================================================
+class Application(object):
+    '''Main application class.'''
+
+    def main(self):
+        '''Public main function.'''
+        # Parse args
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description=PROG_DESCRIPTION,
+            version=PROG_VERSION)
+        parser.add_argument('-n', '--num-frames', type=int, default=100,
+            help='Number of frames to blend.')
+        parser.add_argument('--frame-size', type=int, nargs=2,
+            default=(1920, 1080), metavar=('W', 'H'),
+            help='Size of synthetic frames.')
+        parser.add_argument('--target-size', type=int, nargs=2,
+            default=(2480, 3508), metavar=('W', 'H'),
+            help='Size of the result image.')
+        args = parser.parse_args()
+        (frame_w, frame_h) = args.frame_size
+        (target_w, target_h) = args.target_size
+        try:
+            print "Generating %d frames of %dx%d" % (args.num_frames, frame_w, frame_h)
+            # frames are reused to keep memory usage low
+            rng = np.random.RandomState(0)
+            pool = [rng.randint(0, 256, (frame_h, frame_w, 3)).astype(np.uint8)
+                    for _ in range(min(args.num_frames, 8))]
+            frames = [pool[i % len(pool)] for i in range(args.num_frames)]
+            transforms = random_transforms(args.num_frames,
+                frame_w, frame_h, target_w, target_h)
+
+            print "Blending into %dx%d" % (target_w, target_h)
+            (elapsed, peak) = measure(blend_copy_over,
+                frames, transforms, frame_w, frame_h, target_w, target_h)
+            print "copy-over:  %8.2f ms/frame  %8.1f MB peak" % (
+                1000 * elapsed / args.num_frames, peak)
+            (elapsed, peak) = measure(blend_accumulate,
+                frames, transforms, target_w, target_h)
+            print "Blender:    %8.2f ms/frame  %8.1f MB peak" % (
+                1000 * elapsed / args.num_frames, peak)
+            return EXITCODE_OK
+        except KeyboardInterrupt:
+            print "Process interrupted by user."
+            return EXITCODE_KBDBREAK
+
+# ==============================================================================
+if __name__ == "__main__":
+    res = Application().main()
+    if res is not None:
+        sys.exit(res)
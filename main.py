@@ -58,6 +58,19 @@ class Application(object):
         parser.add_argument('-g', '--gui', 
             action="store_true", 
             help="Activate visualization.")
+        parser.add_argument('-c', '--checkpoint',
+            help="Path to checkpoint file (default: output path + `.ckpt`).")
+        parser.add_argument('-i', '--checkpoint-interval',
+            type=int, default=100,
+            help="Save a checkpoint every N frames (0 to disable).")
+        parser.add_argument('-r', '--resume',
+            action="store_true",
+            help="Resume processing from the checkpoint file.")
+        parser.add_argument('-t', '--trajectory',
+            help="Save the output of the tracker to this file.")
+        parser.add_argument('-p', '--replay',
+            help="Blend frames using the positions stored in this trajectory "
+                 "file instead of tracking the object again.")
         parser.add_argument('task_data', 
             help='Path to `task_data.json` file.')
         parser.add_argument('video', 
@@ -67,6 +80,10 @@ class Application(object):
         parser.add_argument('output', 
             help='Path to output file.')
         args = parser.parse_args()
+        if args.replay is not None and (args.resume or args.trajectory is not None):
+            parser.error("--replay cannot be used with --resume or --trajectory.")
+        if args.checkpoint is None:
+            args.checkpoint = args.output + ".ckpt"
         # activate debug?
         if args.debug:
             self._logger.setLevel(logging.DEBUG)
@@ -84,7 +101,12 @@ class Application(object):
         try:
             self._logger.debug("Launching VideoCapture")
             vcap = VideoCapture(args.debug, args.gui)
-            vcap.process_video(args.task_data, args.video, args.reference_frame, args.output)
+            vcap.process_video(args.task_data, args.video, args.reference_frame, args.output,
+                               checkpoint_path=args.checkpoint,
+                               checkpoint_interval=args.checkpoint_interval,
+                               resume=args.resume,
+                               trajectory_path=args.trajectory,
+                               replay_path=args.replay)
             self._logger.debug("Processing complete.")
             return EXITCODE_OK
         except KeyboardInterrupt:
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+(c) L3i - Univ. La Rochelle
+    joseph.chazalon (at) univ-lr (dot) fr
+
+SmartDoc 2017 Sample Method
+
+Blending tools.
+"""
+
+# ==============================================================================
+# Imports
+import cv2
+import numpy as np
+
+from utils.log import *
+
+# ==============================================================================
+class Blender(object):
+    '''
+    Blends frames into the target image using a weighted mean.
+
+    Each frame, already registered with a perspective transform, is added
+    to a running weighted sum and a running sum of weights. The weight of
+    each pixel is the product of:
+
+    - the distance to the frame border, ramping from 0 to 1 over
+      `border_ratio` of the smallest frame dimension, to fade seams out;
+    - the sharpness of the frame (variance of its Laplacian), to favor
+      frames without motion or focus blur;
+    - the number of frame pixels per target pixel (determinant of the
+      Jacobian of the transform, capped to 1), which gets lower as the
+      viewing angle or the distance to the document increase.
+
+    Pixels outside of the frame get a null weight. Any term can be disabled.
+
+    Weights are computed in frame space, where the frame is premultiplied
+    by them, then both are warped at once as a 4 channels image and added
+    to a single 4 channels accumulator (weighted B, G, R sums and weight sum).
+    Warping is done by horizontal strips of `strip_rows` rows, restricted to
+    the bounding box of the frame in the target, so only a strip sized
+    buffer is needed in target space.
+    All buffers are allocated once and reused for the next frames, so memory
+    does not depend on the length of the video.
+    The result is only normalized and converted to 8 bits by `get_result()`.
+    '''
+    def __init__(self, target_shape,
+                 border_ratio=0.1,
+                 use_border=True,
+                 use_sharpness=True,
+                 use_density=True,
+                 strip_rows=256,
+                 debug=False):
+        '''
+        `target_shape` is the `(height, width)` of the result image.
+        '''
+        self._logger = createAndInitLogger(__name__, debug)
+        self.border_ratio = border_ratio
+        self.use_border = use_border
+        self.use_sharpness = use_sharpness
+        self.use_density = use_density
+
+        (h, w) = target_shape[:2]
+        self._target_shape = (h, w)
+        self._strip_rows = min(strip_rows, h)
+        # accumulator: weighted B, G, R sums and sum of weights
+        self.accumulator = np.zeros((h, w, 4), dtype=np.float32)
+        # flat strip buffer, so views of any width are contiguous
+        self._strip = np.empty(self._strip_rows * w * 4, dtype=np.float32)
+        # per frame buffers in frame space, allocated with the first frame
+        self._frame_shape = None
+        self.frame_weight = None
+
+    def _init_frame_buffers(self, frame_shape):
+        (h, w) = frame_shape[:2]
+        self._frame_shape = (h, w)
+        self._gray = np.empty((h, w), dtype=np.uint8)
+        self._laplacian = np.empty((h, w), dtype=np.float32)
+        self._density = np.empty((h, w), dtype=np.float32)
+        self._us = np.arange(w, dtype=np.float32).reshape(1, w)
+        self._vs = np.arange(h, dtype=np.float32).reshape(h, 1)
+        self._us_tmp = np.empty_like(self._us)
+        self._vs_tmp = np.empty_like(self._vs)
+        self.frame_weight = np.empty((h, w), dtype=np.float32)
+        self._premultiplied = np.empty((h, w, 4), dtype=np.float32)
+        # distance to the closest border, normalized to [0, 1]
+        self._border_map = np.ones((h, w), dtype=np.float32)
+        if self.use_border:
+            ramp_len = max(1.0, self.border_ratio * min(w, h))
+            x_dist = np.minimum(np.arange(w), np.arange(w)[::-1]).astype(np.float32)
+            y_dist = np.minimum(np.arange(h), np.arange(h)[::-1]).astype(np.float32)
+            np.minimum(x_dist.reshape(1, w), y_dist.reshape(h, 1), out=self._border_map)
+            self._border_map += 1.0
+            self._border_map /= ramp_len
+            np.minimum(self._border_map, 1.0, out=self._border_map)
+
+    def _sharpness(self, frame):
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.Laplacian(self._gray, cv2.CV_32F, dst=self._laplacian)
+        (_, stddev) = cv2.meanStdDev(self._laplacian)
+        return float(stddev[0][0]) ** 2
+
+    def _multiply_by_density(self, trans):
+        '''
+        Multiplies `frame_weight` by the area of a target pixel in the frame.
+        At frame pixel (u, v), it is 1 / |det(J)| = |w(u, v)|^3 / |det(H)|
+        where H is the frame to target transform and
+        w(u, v) = H[2, 0] u + H[2, 1] v + H[2, 2].
+        '''
+        density = self._density
+        np.multiply(self._us, trans[2, 0], out=self._us_tmp)
+        np.multiply(self._vs, trans[2, 1], out=self._vs_tmp)
+        self._vs_tmp += trans[2, 2]
+        np.add(self._us_tmp, self._vs_tmp, out=density)
+        np.abs(density, out=density)
+        # density^3 / |det(H)|, capped to 1: resolution is no longer limited
+        # by the geometry above
+        np.multiply(density, density, out=self._laplacian)
+        self._laplacian *= density
+        self._laplacian /= abs(np.linalg.det(trans))
+        np.minimum(self._laplacian, 1.0, out=self._laplacian)
+        self.frame_weight *= self._laplacian
+
+    def _target_bounds(self, trans):
+        '''
+        Returns the (x0, y0, x1, y1) bounding box of the frame in the target.
+        '''
+        (h, w) = self._frame_shape
+        (th, tw) = self._target_shape
+        corners = np.float64([[0, 0, 1], [0, h, 1], [w, h, 1], [w, 0, 1]])
+        projected = corners.dot(np.transpose(trans))
+        if (projected[:, 2] <= 0).any():
+            # frame crosses the horizon of the document plane
+            return (0, 0, tw, th)
+        projected = projected[:, :2] / projected[:, 2:]
+        (x0, y0) = np.floor(projected.min(axis=0)) - 1
+        (x1, y1) = np.ceil(projected.max(axis=0)) + 2
+        return (int(max(0, x0)), int(max(0, y0)),
+                int(min(tw, max(0, x1))), int(min(th, max(0, y1))))
+
+    def add_frame(self, frame, trans):
+        '''
+        Blends `frame` into the result, `trans` being the 3x3 perspective
+        transform from frame to target coordinates.
+        '''
+        if self._frame_shape != frame.shape[:2]:
+            self._init_frame_buffers(frame.shape)
+
+        # weights in frame space (sharpness first: density reuses its buffer)
+        np.copyto(self.frame_weight, self._border_map)
+        if self.use_sharpness:
+            sharpness = self._sharpness(frame)
+            self._logger.debug("Blending frame with sharpness %.2f" % sharpness)
+            self.frame_weight *= sharpness
+        if self.use_density:
+            self._multiply_by_density(trans)
+        np.multiply(frame, self.frame_weight[:, :, np.newaxis],
+                    out=self._premultiplied[:, :, :3])
+        self._premultiplied[:, :, 3] = self.frame_weight
+
+        # warp and accumulate by strips, pixels outside of the frame get 0
+        (x0, y0, x1, y1) = self._target_bounds(trans)
+        for sy0 in range(y0, y1, self._strip_rows):
+            sy1 = min(sy0 + self._strip_rows, y1)
+            strip = self._strip[:(sy1 - sy0) * (x1 - x0) * 4].reshape(
+                sy1 - sy0, x1 - x0, 4)
+            shift = np.float64([[1, 0, -x0], [0, 1, -sy0], [0, 0, 1]])
+            cv2.warpPerspective(self._premultiplied, shift.dot(trans),
+                                (x1 - x0, sy1 - sy0), dst=strip,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            self.accumulator[sy0:sy1, x0:x1] += strip
+
+    def get_result(self, out=None):
+        '''
+        Returns the weighted mean of the frames as an 8 bits BGR image,
+        written into `out` if given. Pixels no frame covered are black.
+        '''
+        (h, w) = self._target_shape
+        if out is None:
+            out = np.empty((h, w, 3), dtype=np.uint8)
+        tiny = np.finfo(np.float32).tiny
+        for y0 in range(0, h, self._strip_rows):
+            y1 = min(y0 + self._strip_rows, h)
+            size = (y1 - y0) * w
+            values = self._strip[:size * 3].reshape(y1 - y0, w, 3)
+            norm = self._strip[size * 3:size * 4].reshape(y1 - y0, w)
+            np.maximum(self.accumulator[y0:y1, :, 3], tiny, out=norm)
+            np.divide(self.accumulator[y0:y1, :, :3], norm[:, :, np.newaxis], out=values)
+            # rounds and saturates to 8 bits
+            cv2.convertScaleAbs(values, dst=out[y0:y1])
+        return out
+
+    def get_state(self):
+        '''
+        Returns the accumulator itself, to be restored with `set_state()`.
+        It is updated by the next frames: copy it to keep this state.
+        '''
+        return self.accumulator
+
+    def set_state(self, state):
+        if state.shape != self.accumulator.shape:
+            raise ValueError("Blender state does not match target shape.")
+        np.copyto(self.accumulator, state)
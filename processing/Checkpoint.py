@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+(c) L3i - Univ. La Rochelle
+    joseph.chazalon (at) univ-lr (dot) fr
+
+SmartDoc 2017 Sample Method
+
+Checkpointing tools, to resume the processing of a video after an
+interruption.
+"""
+
+# ==============================================================================
+# Imports
+import cPickle as pickle
+import os
+import os.path
+import threading
+
+import numpy as np
+
+from utils.log import *
+
+# ==============================================================================
+CHECKPOINT_VERSION = 1
+
+# ==============================================================================
+def load_checkpoint(filename):
+    '''
+    Reads a checkpoint written by `CheckpointWriter` and returns its content
+    as a dictionary.
+    '''
+    with open(filename, "rb") as infile:
+        try:
+            state = pickle.load(infile)
+            if not isinstance(state, dict) or state.get("version") != CHECKPOINT_VERSION:
+                raise ValueError()
+            for key in state.pop("arrays"):
+                state[key] = np.load(infile)
+        except (pickle.UnpicklingError, EOFError, KeyError, ValueError):
+            raise IOError("'%s' is not a valid checkpoint file." % filename)
+    return state
+
+# ==============================================================================
+class CheckpointWriter(object):
+    '''
+    Writes checkpoints to a file in a background thread, so the processing
+    loop is only delayed by the copy of the state.
+    The file starts with a pickled dictionary of the values which are not
+    numpy arrays, followed by the arrays in the `.npy` format, which are
+    written without any further copy.
+    Only one write is performed at a time: saving a new checkpoint first waits
+    for the previous one to complete. Files are written under a temporary name
+    and then renamed, so a valid checkpoint is always available on disk.
+    '''
+    def __init__(self, filename, debug=False):
+        self._logger = createAndInitLogger(__name__, debug)
+        self.filename = filename
+        self._thread = None
+
+    def save(self, state, wait=False):
+        '''
+        Saves a snapshot of `state`, a dictionary which may contain numpy
+        arrays and lists (they are copied before returning). Blocks until the
+        file is written if `wait` is `True`, in which case arrays are written
+        without being copied.
+        '''
+        self.wait()
+        snapshot = {}
+        for (k, v) in state.items():
+            if isinstance(v, np.ndarray):
+                if not wait:
+                    v = v.copy()
+            elif isinstance(v, list):
+                v = list(v)
+            snapshot[k] = v
+        self._thread = threading.Thread(target=self._write, args=(snapshot,))
+        self._thread.daemon = True
+        self._thread.start()
+        if wait:
+            self.wait()
+
+    def wait(self):
+        '''
+        Waits for the pending write, if any, to complete.
+        '''
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def remove(self):
+        '''
+        Waits for the pending write and deletes the checkpoint file.
+        '''
+        self.wait()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+            self._logger.debug("Removed checkpoint '%s'." % self.filename)
+
+    def _write(self, snapshot):
+        tmp_filename = self.filename + ".tmp"
+        try:
+            arrays = sorted(k for (k, v) in snapshot.items() if isinstance(v, np.ndarray))
+            header = dict((k, v) for (k, v) in snapshot.items() if k not in arrays)
+            header["version"] = CHECKPOINT_VERSION
+            header["arrays"] = arrays
+            with open(tmp_filename, "wb") as outfile:
+                pickle.dump(header, outfile, pickle.HIGHEST_PROTOCOL)
+                for key in arrays:
+                    np.save(outfile, snapshot[key], allow_pickle=False)
+            if os.name == "nt" and os.path.exists(self.filename):
+                # rename does not overwrite on Windows
+                os.remove(self.filename)
+            os.rename(tmp_filename, self.filename)
+            self._logger.debug("Wrote checkpoint for frame %d to '%s'."
+                % (snapshot["frame_index"], self.filename))
+        except (IOError, OSError):
+            self._logger.exception("Could not write checkpoint '%s'." % self.filename)
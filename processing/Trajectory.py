@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+(c) L3i - Univ. La Rochelle
+    joseph.chazalon (at) univ-lr (dot) fr
+
+SmartDoc 2017 Sample Method
+
+Trajectory tools, to store the output of the tracker and blend frames again
+without tracking them.
+"""
+
+# ==============================================================================
+# Imports
+import numpy as np
+
+# ==============================================================================
+def load_trajectory(filename):
+    '''
+    Reads a trajectory written by `Trajectory.save()`.
+    '''
+    try:
+        with open(filename, "rb") as infile:
+            data = np.load(infile)
+            trajectory = Trajectory(str(data["video"]), int(data["frame_count"]),
+                                    tuple(int(v) for v in data["frame_shape"]),
+                                    int(data["reference_frame_id"]))
+            for (frame_index, rejected, quad) in zip(
+                    data["frame_index"], data["rejected"], data["quads"]):
+                trajectory.entries.append((int(frame_index), bool(rejected),
+                    None if rejected else tuple(tuple(pt) for pt in quad)))
+    except (KeyError, ValueError):
+        raise IOError("'%s' is not a valid trajectory file." % filename)
+    return trajectory
+
+# ==============================================================================
+class Trajectory(object):
+    '''
+    Output of the tracker for each frame processed after the reference frame
+    of `video`, which should be an absolute path. The frame count and the
+    `(x_len, y_len)` frame shape of the video identify it when replaying.
+    Each entry is a tuple `(frame_index, rejected, quad)` where `quad` is
+    `None` for rejected frames, and the `(tl, bl, br, tr)` corners of the
+    object in the frame otherwise.
+    '''
+    def __init__(self, video, frame_count, frame_shape, reference_frame_id,
+                 entries=None):
+        self.video = video
+        self.frame_count = frame_count
+        self.frame_shape = tuple(frame_shape)
+        self.reference_frame_id = reference_frame_id
+        self.entries = list(entries) if entries is not None else []
+
+    def append(self, frame_index, rejected, tl, bl, br, tr):
+        quad = None
+        if not rejected:
+            quad = tuple((float(pt[0]), float(pt[1])) for pt in (tl, bl, br, tr))
+        self.entries.append((frame_index, rejected, quad))
+
+    def accepted(self):
+        '''
+        Returns the list of `(frame_index, quad)` for accepted frames, in
+        increasing frame order.
+        '''
+        return sorted((frame_index, quad)
+                      for (frame_index, rejected, quad) in self.entries
+                      if not rejected)
+
+    def save(self, filename):
+        '''
+        Writes the trajectory as a compressed numpy archive. Corners of
+        rejected frames are stored as NaN.
+        '''
+        quads = np.empty((len(self.entries), 4, 2), dtype=np.float32)
+        quads.fill(np.nan)
+        for (i, (_, rejected, quad)) in enumerate(self.entries):
+            if not rejected:
+                quads[i] = quad
+        # passing a file object prevents numpy from appending `.npz`
+        with open(filename, "wb") as outfile:
+            np.savez_compressed(outfile,
+                video=np.array(self.video),
+                frame_count=np.int32(self.frame_count),
+                frame_shape=np.int32(self.frame_shape),
+                reference_frame_id=np.int32(self.reference_frame_id),
+                frame_index=np.int32([e[0] for e in self.entries]),
+                rejected=np.bool_([e[1] for e in self.entries]),
+                quads=quads)
@@ -12,6 +12,7 @@ Processing module.
 # ==============================================================================
 # Imports
 import json
+import os.path
 from collections import namedtuple
 
 import cv2
@@ -19,6 +20,9 @@ import numpy as np
 
 from utils.log import *
 from trackers.SIFT_BFTracker import SIFT_BFTracker
+from processing.Checkpoint import CheckpointWriter, load_checkpoint
+from processing.Trajectory import Trajectory, load_trajectory
+from processing.Blender import Blender
 
 # ==============================================================================
 # Internal type definition
@@ -87,22 +91,120 @@ class VideoCapture(object):
                 cv2.putText(image, name, (int(pt[0]), int(pt[1])),
                     cv2.FONT_HERSHEY_PLAIN, 2, (64, 255, 64), 2)
 
+    def _same_video(self, filename, video, frame_count, frame_shape,
+                    video_path, current_frame_count, current_frame_shape):
+        '''
+        Tells whether `filename` was produced for the video at `video_path`.
+        Videos are identified by their frame count and frame shape: the
+        video may have been moved or accessed through another path, so a
+        different path only triggers a warning.
+        '''
+        if frame_count != current_frame_count or \
+           tuple(frame_shape) != tuple(current_frame_shape):
+            return False
+        if video != os.path.abspath(video_path):
+            self._logger.warning("'%s' was produced for video '%s', using '%s'."
+                % (filename, video, video_path))
+        return True
+
+    def _resume_from_checkpoint(self, checkpoint_path, video_path,
+                                frame_count, frame_shape,
+                                reference_frame_id, blender, tracker):
+        '''
+        Reads the checkpoint, checks it was produced for the same inputs, and
+        restores the blender and tracker states.
+        Returns a tuple with the index of the last processed frame and the
+        trajectory.
+        '''
+        self._logger.info("Resuming from checkpoint '%s'." % checkpoint_path)
+        ckpt = load_checkpoint(checkpoint_path)
+        if not self._same_video(checkpoint_path, ckpt["video"],
+                                ckpt["frame_count"], ckpt["frame_shape"],
+                                video_path, frame_count, frame_shape) or \
+           ckpt["reference_frame_id"] != reference_frame_id:
+            raise IOError("Checkpoint '%s' does not match the current inputs." % checkpoint_path)
+        try:
+            blender.set_state(ckpt["blender"])
+        except ValueError:
+            raise IOError("Checkpoint '%s' does not match the current inputs." % checkpoint_path)
+        tracker.setState(ckpt["tracker"])
+        trajectory = Trajectory(os.path.abspath(video_path), frame_count,
+                                frame_shape, reference_frame_id,
+                                ckpt.get("trajectory"))
+        return (ckpt["frame_index"], trajectory)
+
+    def _skip_frames(self, videocap, current_frame_index, last_frame_index):
+        '''
+        Skips frames until `last_frame_index` is the last frame read, and
+        returns it.
+        grab() does not decode frames into images, and is more reliable
+        than seeking with CV_CAP_PROP_POS_FRAMES on compressed streams.
+        '''
+        while current_frame_index < last_frame_index:
+            vcap_is_ok = videocap.grab()
+            current_frame_index += 1
+            self._check_vcap_is_ok(vcap_is_ok, current_frame_index)
+        return current_frame_index
+
+    def _track_frames(self, videocap, tracker, current_frame_index):
+        '''
+        Reads the frames following `current_frame_index` until the end of
+        the stream and locates the object in each of them.
+        Yields tuples `(frame_index, frame, rejected, tl, bl, br, tr)`.
+        '''
+        while True:
+            vcap_is_ok, current_frame = videocap.read()
+            if not vcap_is_ok:
+                self._logger.debug("End of stream reached after frame %d" % current_frame_index)
+                # end of stream reached
+                return
+            current_frame_index += 1
+            (rejected, tl, bl, br, tr) = tracker.processFrame(current_frame)
+            yield (current_frame_index, current_frame, rejected, tl, bl, br, tr)
+
+    def _replay_trajectory(self, videocap, trajectory, current_frame_index):
+        '''
+        Yields the same tuples as `_track_frames()` for the accepted frames
+        of `trajectory` which follow `current_frame_index`, using the stored
+        object positions. Rejected frames are not decoded, and the stream is
+        not read past the last accepted frame.
+        '''
+        for (frame_index, quad) in trajectory.accepted():
+            if frame_index <= current_frame_index:
+                continue
+            current_frame_index = self._skip_frames(
+                videocap, current_frame_index, frame_index - 1)
+            vcap_is_ok, current_frame = videocap.read()
+            current_frame_index += 1
+            self._check_vcap_is_ok(vcap_is_ok, current_frame_index)
+            yield (current_frame_index, current_frame, False) + quad
+
     def process_video(self, task_data_path, video_path, 
-                      reference_frame_path, output_path):
+                      reference_frame_path, output_path,
+                      checkpoint_path=None, checkpoint_interval=0,
+                      resume=False, trajectory_path=None, replay_path=None):
         '''
         This is the main function which processes a video capture and
         produces a restored image.
         In this example the video is processed in a single pass (in order
         to comply with what a real mobile application would probably
-        have to do) and the blending is very naive.
+        have to do) and the blending is a simple weighted mean.
         Perspective transform is estimated using keypoint matching
         with SIFT descriptors.
+        If `checkpoint_interval` > 0, the state of the processing is saved to
+        `checkpoint_path` every `checkpoint_interval` frames and when the
+        process is interrupted. If `resume` is `True`, processing restarts
+        after the last frame saved in `checkpoint_path`.
+        If `trajectory_path` is given, the output of the tracker is saved to
+        this file. If `replay_path` is given, object positions are read from
+        such a file instead of tracking the object again, and checkpoints are
+        not used.
         '''
         # define windows names for GUI
         win_result = "Result Image"
         win_video = "Video Input"
         win_ref_frame = "Reference Frame"
-        win_mask = "Blending Mask"
+        win_mask = "Blending Weights"
         if self._gui:
             for win in (win_result, win_video, win_ref_frame, win_mask):
                 cv2.namedWindow(win, cv2.WINDOW_NORMAL)
@@ -132,9 +234,6 @@ class VideoCapture(object):
         if frame_count <= reference_frame_id:
             raise IOError("Reference frame id is out of range for video.")
 
-        # prepare output structure (we could read and copy reference frame instead)
-        result_image = np.zeros(target_image_shape, dtype=np.float32)
-
         # read first frame
         current_frame_index = 0
         vcap_is_ok, current_frame = videocap.read()
@@ -164,80 +263,147 @@ class VideoCapture(object):
 
         # warp reference frame into target image
         trans = cv2.getPerspectiveTransform(object_poly, target_poly)
-        result_image = cv2.warpPerspective(reference_frame, trans, result_image.shape)
+        reference_image = cv2.warpPerspective(reference_frame, trans,
+            (target_image_shape.x_len, target_image_shape.y_len))
+
+        # prepare output structure and blend the reference frame into it
+        # Note: the blender allocates all its buffers once
+        blender = Blender((target_image_shape.y_len, target_image_shape.x_len),
+                          debug=self._debug)
+        blender.add_frame(reference_frame, trans)
+        result_image = None
+        if self._gui:
+            result_image = blender.get_result()
         self._show_image(win_result, result_image)
 
-        # (naive) create a simple SIFT tracker to project frames
-        # Note: There may be better techniques to estimate the relative position
-        # between the camera and the document, or the position between the 
-        # reference frame and the current frame.
-        logger.debug("Creating tracker.")
-        tracker = SIFT_BFTracker(debug=self._debug)
-        logger.debug("Reinitializing tracker with frame size (w=%.3f; h=%.3f)" 
-            % (frame_shape.x_len, frame_shape.y_len))
-        tracker.reinitFrameSize(frame_shape.x_len, frame_shape.y_len)
-        logger.debug("Configuring tracker's model")
-        tracker.reconfigureModel(result_image)
-        logger.debug("Tracker configuration complete.")
+        # replay stored object positions: no need for a tracker
+        ckpt_writer = None
+        tracker = None
+        if replay_path is not None:
+            logger.debug("Replaying trajectory '%s'." % replay_path)
+            replayed = load_trajectory(replay_path)
+            if not self._same_video(replay_path, replayed.video,
+                                    replayed.frame_count, replayed.frame_shape,
+                                    video_path, frame_count, frame_shape) or \
+               replayed.reference_frame_id != reference_frame_id:
+                raise IOError("Trajectory '%s' does not match the current inputs." % replay_path)
+            frames = self._replay_trajectory(videocap, replayed, current_frame_index)
+        else:
+            # (naive) create a simple SIFT tracker to project frames
+            # Note: There may be better techniques to estimate the relative position
+            # between the camera and the document, or the position between the 
+            # reference frame and the current frame.
+            logger.debug("Creating tracker.")
+            tracker = SIFT_BFTracker(debug=self._debug)
+            logger.debug("Reinitializing tracker with frame size (w=%.3f; h=%.3f)" 
+                % (frame_shape.x_len, frame_shape.y_len))
+            tracker.reinitFrameSize(frame_shape.x_len, frame_shape.y_len)
+            logger.debug("Configuring tracker's model")
+            tracker.reconfigureModel(reference_image)
+            logger.debug("Tracker configuration complete.")
+
+            # restore previous state and skip the frames it already contains
+            trajectory = Trajectory(os.path.abspath(video_path), frame_count,
+                                    frame_shape, reference_frame_id)
+            if resume:
+                (last_frame_index, trajectory) = self._resume_from_checkpoint(
+                    checkpoint_path, video_path, frame_count, frame_shape,
+                    reference_frame_id, blender, tracker)
+                logger.info("Skipping frames up to %d" % last_frame_index)
+                current_frame_index = self._skip_frames(
+                    videocap, current_frame_index, last_frame_index)
+                if self._gui:
+                    self._show_image(win_result, blender.get_result(out=result_image))
+
+            # periodically save the state in the background
+            if checkpoint_path is not None and checkpoint_interval > 0:
+                ckpt_writer = CheckpointWriter(checkpoint_path, self._debug)
+            make_checkpoint = lambda: {
+                "video": os.path.abspath(video_path),
+                "frame_count": frame_count,
+                "frame_shape": tuple(frame_shape),
+                "reference_frame_id": reference_frame_id,
+                "frame_index": last_frame_index,
+                "blender": blender.get_state(),
+                "trajectory": trajectory.entries,
+                "tracker": tracker.getState()}
+            frames = self._track_frames(videocap, tracker, current_frame_index)
+        last_frame_index = current_frame_index
+        # set while the state is updated with the current frame: a checkpoint
+        # saved then would count the frame twice after resuming
+        frame_in_progress = False
 
         # iterate over video frames
-        while True:
-            vcap_is_ok, current_frame = videocap.read()
-            if not vcap_is_ok:
-                logger.debug("End of stream reached after frame %d" % current_frame_index)
-                # end of stream reached
-                break
-            current_frame_index += 1
-            current_frame_orig = current_frame.copy()
-
-            # find the object
-            (rejected, tl, bl, br, tr) = tracker.processFrame(current_frame_orig)
-            if not rejected:
-                logger.info("frame %03d: A tl:(%-4.2f,%-4.2f) bl:(%-4.2f,%-4.2f) "
-                                     "br:(%-4.2f,%-4.2f) tr:(%-4.2f,%-4.2f)" 
-                            %(current_frame_index, 
-                                tl[0], tl[1], bl[0], bl[1], br[0], br[1], tr[0], tr[1]))
-                self._overlay_poly(current_frame, [tl, bl, br, tr])
-            else:
-                logger.info("frame %03d: R" % current_frame_index)
+        try:
+            for (current_frame_index, current_frame,
+                 rejected, tl, bl, br, tr) in frames:
+                # keep frame clean for blending if GUI draws over it
+                current_frame_orig = current_frame
                 if self._gui:
-                    cv2.circle(current_frame, (frame_shape.x_len/2, frame_shape.y_len/2), 
-                        20, (0, 0, 255), 10)
-            self._show_image(win_video, current_frame)
+                    current_frame_orig = current_frame.copy()
+
+                # report the position of the object
+                if not rejected:
+                    logger.info("frame %03d: A tl:(%-4.2f,%-4.2f) bl:(%-4.2f,%-4.2f) "
+                                         "br:(%-4.2f,%-4.2f) tr:(%-4.2f,%-4.2f)" 
+                                %(current_frame_index, 
+                                    tl[0], tl[1], bl[0], bl[1], br[0], br[1], tr[0], tr[1]))
+                    self._overlay_poly(current_frame, [tl, bl, br, tr])
+                else:
+                    logger.info("frame %03d: R" % current_frame_index)
+                    if self._gui:
+                        cv2.circle(current_frame, (frame_shape.x_len/2, frame_shape.y_len/2), 
+                            20, (0, 0, 255), 10)
+                self._show_image(win_video, current_frame)
             
-            # blend object region directly into result image
-            if not rejected:
-                object_poly = np.float32([tl, bl, br, tr])
-                trans = cv2.getPerspectiveTransform(object_poly, target_poly)
-                frame_poly = np.float32([[0, 0],
-                               [0, frame_shape.y_len-1],
-                               [frame_shape.x_len-1, frame_shape.y_len-1],
-                               [frame_shape.x_len-1, 0]])   
-
-                mask = np.zeros(result_image.shape, dtype=np.uint8)
-                result_roi = cv2.perspectiveTransform(
-                    frame_poly.reshape(1, -1, 2), 
-                    trans).reshape(-1, 2)
-                result_roi = np.int32(result_roi)
-                white = (255,255,255) 
-                cv2.fillPoly(mask, [result_roi], white)
-                self._show_image(win_mask, mask)
-                pre_result = cv2.warpPerspective(
-                    current_frame_orig, 
-                    trans, 
-                    (result_image.shape[1],result_image.shape[0]))
-                # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-                # NOTE: changing the following line might be the easiest
-                # way to improve this naive implementation. Here we
-                # merely copy the content of the current frame over the
-                # result image, overwriting previous pixel without any
-                # weighting, discarding, color correction, perspective 
-                # adjustment, border fading, etc.
-                # There are, of course, many other possible improvements
-                # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-                np.copyto(result_image, pre_result, where=(mask>0)) # !!!!!!!!!!
-                # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-            self._show_image(win_result, result_image)
+                # blend object region into result image
+                frame_in_progress = True
+                if not rejected:
+                    object_poly = np.float32([tl, bl, br, tr])
+                    trans = cv2.getPerspectiveTransform(object_poly, target_poly)
+                    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+                    # NOTE: improving the `Blender` class might be the easiest
+                    # way to improve this naive implementation. Here we
+                    # merely compute a weighted mean of the frames, with
+                    # weights favoring sharp frames, pixels far from the
+                    # frame borders and low viewing angles, without any
+                    # discarding, color correction, etc.
+                    # There are, of course, many other possible improvements
+                    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+                    blender.add_frame(current_frame_orig, trans) # !!!!!!!!!!!!!!
+                    # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+
+                # frame complete
+                last_frame_index = current_frame_index
+                if replay_path is None:
+                    trajectory.append(current_frame_index, rejected, tl, bl, br, tr)
+                frame_in_progress = False
+
+                if self._gui:
+                    if not rejected:
+                        self._show_image(win_mask, cv2.normalize(
+                            blender.frame_weight, None, 0, 1, cv2.NORM_MINMAX))
+                    self._show_image(win_result, blender.get_result(out=result_image))
+                if ckpt_writer is not None and \
+                   current_frame_index % checkpoint_interval == 0:
+                    ckpt_writer.save(make_checkpoint())
+        except KeyboardInterrupt:
+            if ckpt_writer is not None:
+                if frame_in_progress:
+                    logger.info("Interrupted while blending frame %d, keeping last checkpoint."
+                        % current_frame_index)
+                    ckpt_writer.wait()
+                else:
+                    logger.info("Saving checkpoint after frame %d." % last_frame_index)
+                    ckpt_writer.save(make_checkpoint(), wait=True)
+            raise
+        finally:
+            if tracker is not None:
+                tracker.close()
+
+        if trajectory_path is not None and replay_path is None:
+            trajectory.save(trajectory_path)
+            logger.debug("Wrote trajectory to '%s'." % trajectory_path)
 
         # write output
         # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
@@ -246,9 +412,16 @@ class VideoCapture(object):
         # source. Beware of not introducing noise at it will penalize your 
         # results.
         # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+        result_image = blender.get_result(out=result_image)
         cv2.imwrite(output_path, result_image)
         # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
         logger.debug("Wrote result image to '%s'." % output_path)
+        # the checkpoint is useless once the output is written, including the
+        # one resumed from when checkpoints are disabled
+        if ckpt_writer is not None:
+            ckpt_writer.remove()
+        elif resume and replay_path is None:
+            CheckpointWriter(checkpoint_path, self._debug).remove()
         
         logger.info("Process complete.")
         # wait until user quits if GUI is active
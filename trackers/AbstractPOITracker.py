@@ -11,6 +11,9 @@ Tracking tools.
 
 # ==============================================================================
 # Imports
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import cv2
 import numpy as np
 
@@ -21,12 +24,46 @@ from Tracker import *
 class AbstractPOITracker(Tracker):
     '''
     Abstract class for object tracking using keypoints and local descriptors.
+
+    Keypoint detection is the most expensive step, so two optimizations are
+    available:
+
+    - detection is limited to a region of interest around the last accepted
+      object position (`roi_margin` controls how much it is enlarged), with
+      a fallback to the full frame when the object is not found there;
+    - regions larger than `tile_size` are split into overlapping tiles which
+      are processed by a pool of `num_threads` threads.
+
+    Tiling is disabled by default: small tiles build fewer octaves than the
+    full frame, so results may differ from untiled detection and should be
+    checked on a sample before enabling it.
+    Call `close()` once the tracker is not needed anymore to stop the threads.
     '''
+    # Radius of the image region a keypoint descriptor depends on, relative to
+    # the keypoint size (SIFT: 3 * size / 2 * sqrt(2) * (4 + 1) / 2).
+    KEYPOINT_SUPPORT_RATIO = 5.3
+    # Upper bound of the tile overlap derived from the model keypoints, in
+    # (downscaled) frame pixels, also used before the object is located.
+    MAX_TILE_OVERLAP = 128
+    # Detection areas start on multiples of this, so that the image pyramids
+    # of the detector sample the same pixels as for the whole frame.
+    DETECTION_ALIGNMENT = 32
+    # Above this fraction of the frame, the ROI is not worth the risk of
+    # detecting twice.
+    MAX_ROI_AREA_RATIO = 0.75
+    # Number of threads used when num_threads <= 0, to leave CPUs to the
+    # internal threads of OpenCV.
+    MAX_DEFAULT_THREADS = 4
+
     def __init__(self, detector, matcher,
                  num_pyrdown_model=0,
                  num_pyrdown_frames=0,
                  num_of_matches=15,
                  second_match_tresh=0.75,
+                 roi_margin=0.25,
+                 tile_size=0,
+                 tile_overlap=None,
+                 num_threads=1,
                  debug=False):
         super(AbstractPOITracker, self).__init__(
                 num_pyrdown_model=num_pyrdown_model,
@@ -38,10 +75,28 @@ class AbstractPOITracker(Tracker):
         self.matcher = matcher
         self.num_of_matches = num_of_matches
         self.second_match_tresh = second_match_tresh
+        # roi_margin < 0 disables ROI detection, tile_size <= 0 disables tiling,
+        # tile_overlap = None derives the overlap from the model keypoints
+        # (see _tileOverlap()),
+        # num_threads <= 0 uses one thread per CPU up to MAX_DEFAULT_THREADS
+        self.roi_margin = roi_margin
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.num_threads = num_threads
+        if num_threads <= 0:
+            self.num_threads = min(multiprocessing.cpu_count(), self.MAX_DEFAULT_THREADS)
+        self._pool = None
+        self._model_support = 0
+        self._last_quad = None
+
+    def reinitFrameSize(self, frame_width, frame_height):
+        super(AbstractPOITracker, self).reinitFrameSize(frame_width, frame_height)
+        self._last_quad = None
 
     def reconfigureModel(self, model_image):
         # Clears the train descriptor collection.
         self.matcher.clear()
+        self._last_quad = None
 
         Cimg = model_image
         Cimg = self._autoPyrDownModel(Cimg)
@@ -57,6 +112,22 @@ class AbstractPOITracker(Tracker):
         # self.matcher.add(np.uint8([Cdesc]))
         self.matcher.add([Cdesc])
         self.mdl_keyp = Ckeyp
+        # descriptor support of most model keypoints, in model pixels
+        if Ckeyp:
+            self._model_support = self.KEYPOINT_SUPPORT_RATIO * \
+                np.percentile([kp.size for kp in Ckeyp], 95)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def getState(self):
+        return {"last_quad": None if self._last_quad is None else self._last_quad.copy()}
+
+    def setState(self, state):
+        self._last_quad = None if state is None else state.get("last_quad")
 
     def processFrame(self, frame_image):
         rejectCurrent = True
@@ -69,31 +140,169 @@ class AbstractPOITracker(Tracker):
         img = self._autoPyrDownFrame(img)
 
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        (keypoints,descriptors) = self.detector.detectAndCompute(gray,None)
+        roi = self._predictedRoi(gray)
+        q = self._locateModel(*self._detectAndCompute(gray, roi))
+        if q is None and roi is not None:
+            self._logger.debug("R: object not found in ROI %s, trying full frame", str(roi))
+            q = self._locateModel(*self._detectAndCompute(gray, None))
+        # keep (downscaled) position to predict the ROI of the next frame
+        self._last_quad = q
+
+        if q is not None:
+            rejectCurrent = False
+            tl = (self._scaleCoord(q[0][0]), self._scaleCoord(q[0][1]))
+            bl = (self._scaleCoord(q[1][0]), self._scaleCoord(q[1][1]))
+            br = (self._scaleCoord(q[2][0]), self._scaleCoord(q[2][1]))
+            tr = (self._scaleCoord(q[3][0]), self._scaleCoord(q[3][1]))
+
+        return (rejectCurrent, tl, bl, br, tr)
+
+    def _locateModel(self, keypoints, descriptors):
+        '''
+        Matches frame keypoints against the model and returns the 4x2 array
+        of the model corners projected in the (downscaled) frame, or `None`
+        if the model could not be located.
+        '''
         if descriptors is None:
             self._logger.debug("R no descriptors")
+            return None
+        matches = self.matcher.knnMatch(descriptors, k = 2)
+        matches = [m[0] for m in matches if len(m) >= 2 and m[0].distance < m[1].distance * self.second_match_tresh]
+        if len(matches) < self.num_of_matches:
+            self._logger.debug("R: not enough matches (%d < %d)", len(matches), self.num_of_matches)
+            return None
+        pt00 = [self.mdl_keyp[m.trainIdx].pt for m in matches]
+        pt10 = [keypoints[m.queryIdx].pt for m in matches]
+        pt0, pt1 = np.float32((pt00, pt10))
+        H, s = cv2.findHomography(pt0, pt1, cv2.RANSAC, 3.0)
+
+        s = s.ravel() != 0
+        if s.sum() < self.num_of_matches:
+            self._logger.debug("R: not enough RANSAC inliers (%d < %d, got %d matches before)", s.sum(), self.num_of_matches, len(matches))
+            return None
+        return cv2.perspectiveTransform(self.mdl_quad.reshape(1, -1, 2), H).reshape(-1, 2)
+
+    def _predictedRoi(self, gray):
+        '''
+        Returns the rectangle (x0, y0, x1, y1) where the object is expected
+        in `gray`, i.e. the bounding box of the last accepted quad enlarged
+        by `roi_margin` on each side, or `None` if the whole frame must be
+        searched.
+        '''
+        if self._last_quad is None or self.roi_margin < 0:
+            return None
+        (h, w) = gray.shape[:2]
+        (qx0, qy0) = self._last_quad.min(axis=0)
+        (qx1, qy1) = self._last_quad.max(axis=0)
+        mx = (qx1 - qx0) * self.roi_margin
+        my = (qy1 - qy0) * self.roi_margin
+        align = self.DETECTION_ALIGNMENT
+        x0 = max(0, int(qx0 - mx) // align * align)
+        y0 = max(0, int(qy0 - my) // align * align)
+        x1 = min(w, int(np.ceil(qx1 + mx)))
+        y1 = min(h, int(np.ceil(qy1 + my)))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        if (x1 - x0) * (y1 - y0) >= self.MAX_ROI_AREA_RATIO * w * h:
+            # no gain expected
+            return None
+        return (x0, y0, x1, y1)
+
+    def _detectAndCompute(self, gray, roi=None):
+        '''
+        Detects keypoints and computes their descriptors in the rectangle
+        `roi` = (x0, y0, x1, y1) of `gray` (whole image if `None`).
+        Keypoint coordinates are expressed in the `gray` referential.
+
+        The region is handled as an image of its own, and split into tiles of
+        at most `tile_size` pixels and of equal sizes, each one being detected
+        with `_tileOverlap()` pixels of surrounding context inside the region.
+        A keypoint is only kept by the tile which contains it without the
+        overlap, so merged results have no duplicates along tile borders.
+        Keypoints whose descriptor support is cut by a tile border inside the
+        region are dropped.
+        '''
+        (h, w) = gray.shape[:2]
+        if roi is None:
+            roi = (0, 0, w, h)
+        (x0, y0, x1, y1) = roi
+        ovl = self._tileOverlap()
+        align = self.DETECTION_ALIGNMENT
+        tiles = []
+        for (ty0, ty1) in self._split(y0, y1):
+            for (tx0, tx1) in self._split(x0, x1):
+                core = (tx0, ty0, tx1, ty1)
+                crop = (max(x0, (tx0 - ovl) // align * align),
+                        max(y0, (ty0 - ovl) // align * align),
+                        min(x1, tx1 + ovl), min(y1, ty1 + ovl))
+                tiles.append((core, crop))
+
+        detect_tile = lambda tile: self._detectAndComputeTile(gray, roi, tile[0], tile[1])
+        if len(tiles) > 1 and self.num_threads > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self.num_threads)
+            results = self._pool.map(detect_tile, tiles)
         else:
-            matches = self.matcher.knnMatch(descriptors, k = 2)
-            matches = [m[0] for m in matches if len(m) >= 2 and m[0].distance < m[1].distance * self.second_match_tresh]
-            if len(matches) < self.num_of_matches:
-                self._logger.debug("R: not enough matches (%d < %d)", len(matches), self.num_of_matches)
-            else:
-                pt00 = [self.mdl_keyp[m.trainIdx].pt for m in matches]
-                pt10 = [keypoints[m.queryIdx].pt for m in matches]
-                pt0, pt1 = np.float32((pt00, pt10))
-                H, s = cv2.findHomography(pt0, pt1, cv2.RANSAC, 3.0)
-
-                s = s.ravel() != 0
-                if s.sum() < self.num_of_matches:
-                    self._logger.debug("R: not enough RANSAC inliers (%d < %d, got %d matches before)", s.sum(), self.num_of_matches, len(matches))
-                else:
-                    pt0, pt1 = pt0[s], pt1[s]
-                    q = cv2.perspectiveTransform(self.mdl_quad.reshape(1, -1, 2), H).reshape(-1, 2)
-
-                    rejectCurrent = False
-                    tl = (self._scaleCoord(q[0][0]), self._scaleCoord(q[0][1]))
-                    bl = (self._scaleCoord(q[1][0]), self._scaleCoord(q[1][1]))
-                    br = (self._scaleCoord(q[2][0]), self._scaleCoord(q[2][1]))
-                    tr = (self._scaleCoord(q[3][0]), self._scaleCoord(q[3][1]))
-                    
-        return (rejectCurrent, tl, bl, br, tr)
+            results = [detect_tile(tile) for tile in tiles]
+
+        keypoints = []
+        descriptors = []
+        for (tile_keyp, tile_desc) in results:
+            if tile_desc is not None:
+                keypoints.extend(tile_keyp)
+                descriptors.append(tile_desc)
+        if not descriptors:
+            return (keypoints, None)
+        return (keypoints, np.vstack(descriptors))
+
+    def _tileOverlap(self):
+        '''
+        Returns `tile_overlap`, or if it is `None`, the descriptor support of
+        most model keypoints scaled to the size of the object in the frame
+        (from the last accepted quad), at most `MAX_TILE_OVERLAP`.
+        '''
+        if self.tile_overlap is not None:
+            return self.tile_overlap
+        if self._last_quad is None:
+            return self.MAX_TILE_OVERLAP
+        scale = np.sqrt(cv2.contourArea(self._last_quad.astype(np.float32))
+                        / cv2.contourArea(self.mdl_quad))
+        return int(min(self.MAX_TILE_OVERLAP, np.ceil(self._model_support * scale)))
+
+    def _split(self, start, end):
+        '''
+        Splits [start, end) into the least number of ranges of equal lengths
+        not longer than `tile_size`.
+        '''
+        length = end - start
+        num = 1
+        if self.tile_size > 0:
+            num = max(1, int(np.ceil(length / float(self.tile_size))))
+        bounds = [start + (length * i) // num for i in range(num + 1)]
+        return zip(bounds[:-1], bounds[1:])
+
+    def _detectAndComputeTile(self, gray, roi, core, crop):
+        (x0, y0, x1, y1) = roi
+        (cx0, cy0, cx1, cy1) = core
+        (ox0, oy0, ox1, oy1) = crop
+        (keyp, desc) = self.detector.detectAndCompute(gray[oy0:oy1, ox0:ox1], None)
+        if desc is None or len(keyp) == 0:
+            return ([], None)
+        # crop edges inside the region cut descriptor supports
+        (lim_x0, lim_y0) = (ox0 if ox0 > x0 else -np.inf, oy0 if oy0 > y0 else -np.inf)
+        (lim_x1, lim_y1) = (ox1 if ox1 < x1 else np.inf, oy1 if oy1 < y1 else np.inf)
+        kept_keyp = []
+        kept_idx = []
+        for (i, kp) in enumerate(keyp):
+            x = kp.pt[0] + ox0
+            y = kp.pt[1] + oy0
+            r = self.KEYPOINT_SUPPORT_RATIO * kp.size
+            if cx0 <= x < cx1 and cy0 <= y < cy1 and \
+               lim_x0 <= x - r and x + r <= lim_x1 and \
+               lim_y0 <= y - r and y + r <= lim_y1:
+                kept_keyp.append(cv2.KeyPoint(x, y, kp.size, kp.angle,
+                                              kp.response, kp.octave, kp.class_id))
+                kept_idx.append(i)
+        if not kept_idx:
+            return ([], None)
+        return (kept_keyp, desc[kept_idx])
@@ -32,6 +32,9 @@ class SIFT_BFTracker(AbstractPOITracker):
                                           matcher, 
                                           num_pyrdown_model=0, 
                                           num_of_matches=15,
+                                          roi_margin=0.25,
+                                          tile_size=0,
+                                          num_threads=0,
                                           debug=debug)
 
         self._logger = createAndInitLogger(__name__, debug)
@@ -72,6 +72,31 @@ class Tracker(object):
         """
         raise NotImplementedError()
 
+    def getState(self):
+        """
+        Tracker ---> object
+        Returns a picklable snapshot of the state the tracker carries from one
+        frame to the next, so processing can be resumed later using `setState()`.
+        The model and frame size are not part of it: they are configured again
+        before resuming.
+        """
+        return None
+
+    def setState(self, state):
+        """
+        Tracker x object ---> None
+        Restores a state previously returned by `getState()`.
+        """
+        pass
+
+    def close(self):
+        """
+        Tracker ---> None
+        Releases the resources (threads, etc.) held by the tracker.
+        Will be called once after processing each test sequence.
+        """
+        pass
+
     # Utility methods
     # --------------------------------------------------------------------------
     def __init__(self, 